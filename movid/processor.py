@@ -1,14 +1,126 @@
 import os
-import glob
+import re
+import types
 import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import cv2
 from tqdm import tqdm  # for progress bars
 
 import mediapipe as mp
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 
-from movid.task import Task
+from movid.task import Task, create_detectors
+
+# detectors already created in this process, keyed by the configuration that produced them. Creating
+# a detector loads its model from disk and initialises the inference graph (up to seconds per
+# detector), so each worker process builds its detectors once and reuses them for every video it is
+# handed, rather than paying that cost per video:
+_detector_cache = {}
+
+
+def build_detector_options(track, model_folder, strides = None, use_gpu = False):
+    # create the mediapipe detector options needed for each feature to be tracked (hands, face, etc).
+    # this lives at module level (rather than on Processor) because worker processes need to rebuild
+    # the options locally: live MediaPipe objects can't be pickled and sent across process boundaries.
+    # strides is an optional dict mapping detector type to a frame stride (e.g. {'face': 2} runs the
+    # face detector on every second frame); anything unspecified runs on every frame.
+    # use_gpu selects MediaPipe's GPU delegate, which runs the landmark models themselves on the
+    # graphics card (frames are still handed over as ordinary CPU-memory images - MediaPipe uploads
+    # them internally).
+    strides = strides or {}
+    delegate = python.BaseOptions.Delegate.GPU if use_gpu else python.BaseOptions.Delegate.CPU
+    detector_options = []
+    if 'hands' in track:
+        # set options:
+        base_hand_options = python.BaseOptions(model_asset_path = f'{model_folder}/hand_landmarker.task',
+                                               delegate = delegate)
+        # note the RunningMode.VIDEO setting. This is needed so that information can carry over
+        # from one frame to the next (we also need to provide timestamps). This produces much
+        # higher quality results than analysing each frame in isolation, as if it was a still image:
+        hand_options = (
+            vision.HandLandmarkerOptions(base_options = base_hand_options,
+                                         running_mode = mp.tasks.vision.RunningMode.VIDEO,
+                                         num_hands = 2))
+        # these parameters aren't documented but need to be set to avoid exceptions:
+        hand_options.rotation_degrees = 0
+        hand_options.region_of_interest = None
+
+        detector_options.append({'type': 'hands', 'options': hand_options,
+                                 'stride': int(strides.get('hands', 1))})
+
+    if 'face' in track:
+        # see the face detection docs here:
+        # https://developers.google.com/mediapipe/solutions/vision/face_landmarker/python
+        # set options:
+        base_face_options = python.BaseOptions(model_asset_path = f'{model_folder}/face_landmarker.task',
+                                               delegate = delegate)
+        # note the RunningMode.VIDEO setting. This is needed so that information can carry over
+        # from one frame to the next (we also need to provide timestamps). This produces much
+        # higher quality results than analysing each frame in isolation, as if it was a still image:
+        face_options = (
+            vision.FaceLandmarkerOptions(base_options = base_face_options,
+                                         running_mode = mp.tasks.vision.RunningMode.VIDEO))
+        # these parameters aren't documented but need to be set to avoid exceptions:
+        face_options.rotation_degrees = 0
+        face_options.region_of_interest = None
+
+        detector_options.append({'type': 'face', 'options': face_options,
+                                 'stride': int(strides.get('face', 1))})
+
+    if 'pose' in track:
+        # set options:
+        base_pose_options = python.BaseOptions(model_asset_path = f'{model_folder}/pose_landmarker_heavy.task',
+                                               delegate = delegate)
+        # note the RunningMode.VIDEO setting. This is needed so that information can carry over
+        # from one frame to the next (we also need to provide timestamps). This produces much
+        # higher quality results than analysing each frame in isolation, as if it was a still image:
+        pose_options = (
+            vision.PoseLandmarkerOptions(base_options = base_pose_options,
+                                         running_mode = mp.tasks.vision.RunningMode.VIDEO))
+        # these parameters aren't documented but need to be set to avoid exceptions:
+        pose_options.rotation_degrees = 0
+        pose_options.region_of_interest = None
+
+        detector_options.append({'type': 'pose', 'options': pose_options,
+                                 'stride': int(strides.get('pose', 1))})
+
+    return detector_options
+
+
+def _process_one(video_path, config):
+    # analyse a single video. This is a module-level function (rather than a Processor method) so
+    # that it can be dispatched to a ProcessPoolExecutor worker: only the plain-data config dict
+    # crosses the process boundary, and the MediaPipe detectors are created inside the worker.
+    # both OpenCV and MediaPipe's inference backend size their internal thread pools to the full
+    # core count by default. With several worker processes those pools multiply, and the workers
+    # spend more time context-switching than working, so pin each worker to its share of the cores
+    # before any detectors are created (the environment variable must be set before the inference
+    # backend first spins up its threads):
+    worker_threads = config.get('worker_threads')
+    if worker_threads:
+        cv2.setNumThreads(worker_threads)
+        os.environ['OMP_NUM_THREADS'] = str(worker_threads)
+
+    worker_proc = types.SimpleNamespace(**config)
+    strides = config.get('detector_strides')
+    use_gpu = config.get('use_gpu', False)
+    worker_proc.detector_options = build_detector_options(config['track'], config['model_folder'],
+                                                          strides, use_gpu)
+
+    # create (or fetch previously created) detectors for this worker process. Task handles offsetting
+    # timestamps so that reused VIDEO-mode detectors always see them strictly increasing:
+    cache_key = (tuple(config['track']), config['model_folder'],
+                 tuple(sorted(strides.items())) if strides else None, use_gpu)
+    if cache_key not in _detector_cache:
+        _detector_cache[cache_key] = create_detectors(worker_proc.detector_options)
+    worker_proc.detectors = _detector_cache[cache_key]
+
+    task = Task(parent_proc = worker_proc, video_path = video_path)
+    task.analyse_video()
+    return video_path
+
 
 class Processor:
     # this class represents a process in which potentially multiple movement video files will be processed.
@@ -22,15 +134,51 @@ class Processor:
     def __init__(self,
                  input_video_folder = 'videos',  # relative to the working directory
                  specific_videos = None,  # or a list of specific literal file names within input_video_folder
-                 video_suffix = '.MOV',  # likely case-sensitive - ignored if specific_videos provided
+                 video_suffix = '.MOV',  # matched case-insensitively - ignored if specific_videos provided
                  task_types = ['fta', 'hoc'],  # if not listing specific videos, give at least one task code to be
                                                # searched for in filenames (case-insensitive)
                  track = ['hands', 'face', 'pose', 'holistic'],  # specify at least one model (holistic not implemented)
                  model_folder = 'models',  # MediaPipe model files location
                  output_video_folder = 'annotated_videos',
-                 output_data_folder = 'landmark_data'):
+                 output_data_folder = 'landmark_data',
+                 write_annotated_video = True,  # set False to skip drawing/encoding and produce data only
+                 prefetch = 8,  # how many decoded frames may be buffered ahead of inference. Bounds
+                                # peak memory at about prefetch x width x height x 3 bytes per video
+                 allow_frame_drop = False,  # if the buffer is full, drop the oldest frame rather than
+                                            # stalling the decoder. For preview runs only: frames will
+                                            # be missing from the output!
+                 frame_stride = 1,  # analyse only every Nth frame of each video. Skipped frames are
+                                    # advanced with grab() and never decoded, so a stride of N drops
+                                    # nearly (N-1)/N of the decode cost as well as the inference
+                 detect_width = None,  # downscale frames to this width (e.g. 1280) before inference.
+                                       # The landmark models resample to ~192-256 px internally, so
+                                       # full-resolution 4K frames only add conversion/copy cost
+                 detector_strides = None,  # optional dict of frame strides per detector type, e.g.
+                                           # {'face': 2} halves face-detector invocations. Facial
+                                           # movement is slow relative to 60 fps video, so strides of
+                                           # 2-3 there cost little; skipped frames are interpolated
+                                           # in the saved data
+                 output_fourcc = 'mp4v',  # codec for the OpenCV fallback writer (ffmpegcv, when
+                                          # installed, always encodes h264). 'avc1' is faster and
+                                          # smaller where FFmpeg has a hardware H.264 encoder, but
+                                          # has shown keyframe artefacts on some platforms
+                 use_gpu = False,  # run the landmark models on the GPU via MediaPipe's GPU delegate.
+                                   # Several times faster per inference on a discrete GPU, but keep
+                                   # max_workers low (1-2): concurrent workers would otherwise
+                                   # contend for the one GPU
+                 max_workers = None):  # number of videos to process concurrently (None = half the cores)
 
         self.model_folder = model_folder
+        self.track = track
+        self.write_annotated_video = write_annotated_video
+        self.prefetch = prefetch
+        self.frame_stride = frame_stride
+        self.detect_width = detect_width
+        self.detector_strides = detector_strides
+        self.output_fourcc = output_fourcc
+        self.use_gpu = use_gpu
+        self.allow_frame_drop = allow_frame_drop
+        self.max_workers = max_workers
         self.input_video_folder = input_video_folder
         self.input_video_paths = [] # will get populated with the actual video filenames
         self.output_video_folder = output_video_folder
@@ -46,14 +194,39 @@ class Processor:
         # within the parent input_video_folder if necessary) will be processed.
 
         if specific_videos is None:  # recursively identify all videos in the folder
-            possible_videos = glob.glob(pathname = f'{self.input_video_folder}/**/*{video_suffix}', recursive = True)
-
-            for path in possible_videos:
-                pathname, filename = os.path.split(path)
-                for task_type in task_types:
-                    if task_type.lower() in filename.lower():
-                        self.input_video_paths.append(path)
-            print(f'### {len(possible_videos)} possible videos found.')
+            # walk the tree with os.scandir rather than glob: on clinic-scale folders (thousands of
+            # videos) scandir avoids a second stat call per entry and doesn't build one huge
+            # intermediate list. Each filename is lowercased exactly once, rather than once per
+            # task type:
+            suffix_lower = video_suffix.lower()
+            # one precompiled alternation tests all the task codes in a single C-level scan of each
+            # filename, instead of a Python-level substring search per task type. With no task
+            # types at all the alternation would be an empty pattern, which matches every filename
+            # rather than none - so match nothing, and let the zero-videos check below fail fast:
+            task_pattern = None
+            if task_types:
+                task_pattern = re.compile('|'.join(re.escape(task_type.lower()) for task_type in task_types))
+
+            def walk(folder):
+                try:
+                    entries = os.scandir(folder)
+                except FileNotFoundError:
+                    # treat a missing folder as an empty one (as the previous glob-based search
+                    # did); the '0 possible videos found' report below flags the misconfiguration:
+                    return
+                with entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks = False):
+                            yield from walk(entry.path)
+                        elif entry.name.lower().endswith(suffix_lower):
+                            yield entry.path, entry.name.lower()
+
+            num_possible = 0
+            for path, filename_lower in walk(self.input_video_folder):
+                num_possible += 1
+                if task_pattern is not None and task_pattern.search(filename_lower):
+                    self.input_video_paths.append(path)
+            print(f'### {num_possible} possible videos found.')
         else:  # only get the specified files
             for filename in specific_videos:
                 path = f'{self.input_video_folder}/{filename}'
@@ -71,55 +244,8 @@ class Processor:
         # combinations:
         self.features = '-'.join(track)
 
-        # create the mediapipe detectors needed for each feature to be tracked (hands, face, etc):
-        self.detector_options = []
-        if 'hands' in track:
-            # set options:
-            base_hand_options = python.BaseOptions(model_asset_path = f'{self.model_folder}/hand_landmarker.task')
-            # note the RunningMode.VIDEO setting. This is needed so that information can carry over
-            # from one frame to the next (we also need to provide timestamps). This produces much
-            # higher quality results than analysing each frame in isolation, as if it was a still image:
-            hand_options = (
-                vision.HandLandmarkerOptions(base_options = base_hand_options,
-                                             running_mode = mp.tasks.vision.RunningMode.VIDEO,
-                                             num_hands = 2))
-            # these parameters aren't documented but need to be set to avoid exceptions:
-            hand_options.rotation_degrees = 0
-            hand_options.region_of_interest = None
-
-            self.detector_options.append({'type': 'hands', 'options': hand_options})
-
-        if 'face' in track:
-            # see the face detection docs here:
-            # https://developers.google.com/mediapipe/solutions/vision/face_landmarker/python
-            # set options:
-            base_face_options = python.BaseOptions(model_asset_path = f'{self.model_folder}/face_landmarker.task')
-            # note the RunningMode.VIDEO setting. This is needed so that information can carry over
-            # from one frame to the next (we also need to provide timestamps). This produces much
-            # higher quality results than analysing each frame in isolation, as if it was a still image:
-            face_options = (
-                vision.FaceLandmarkerOptions(base_options = base_face_options,
-                                             running_mode = mp.tasks.vision.RunningMode.VIDEO))
-            # these parameters aren't documented but need to be set to avoid exceptions:
-            face_options.rotation_degrees = 0
-            face_options.region_of_interest = None
-
-            self.detector_options.append({'type': 'face', 'options': face_options})
-
-        if 'pose' in track:
-            # set options:
-            base_pose_options = python.BaseOptions(model_asset_path = f'{self.model_folder}/pose_landmarker_heavy.task')
-            # note the RunningMode.VIDEO setting. This is needed so that information can carry over
-            # from one frame to the next (we also need to provide timestamps). This produces much
-            # higher quality results than analysing each frame in isolation, as if it was a still image:
-            pose_options = (
-                vision.PoseLandmarkerOptions(base_options = base_pose_options,
-                                             running_mode = mp.tasks.vision.RunningMode.VIDEO))
-            # these parameters aren't documented but need to be set to avoid exceptions:
-            pose_options.rotation_degrees = 0
-            pose_options.region_of_interest = None
-
-            self.detector_options.append({'type': 'pose', 'options': pose_options})
+        # create the mediapipe detector options needed for each feature to be tracked (hands, face, etc):
+        self.detector_options = build_detector_options(track, self.model_folder, detector_strides, use_gpu)
 
     # once the configuration is done, can simply run the process. This is in a separate function so that
     # it is only invoked once the user has had a chance to see the output of the __init__ function,
@@ -127,6 +253,12 @@ class Processor:
     # gives the user a chance to try the config again.
     def run(self):
 
+        # normally __init__ quits when no videos are found, but guard here too: an empty list would
+        # otherwise clamp the pool to zero workers, which ProcessPoolExecutor rejects.
+        if not self.input_video_paths:
+            print('### No videos to process.')
+            return
+
         start = datetime.datetime.now()
         print(f'Started processing at {str(start).split(".")[0]}.')  # remove the microseconds
 
@@ -135,13 +267,50 @@ class Processor:
                               unit = 'video',
                               leave = True)
 
-        for i, video in enumerate(self.input_video_paths):
-            task = Task(parent_proc = self, video_path = video)
-            task.analyse_video()
+        # MediaPipe inference in VIDEO mode saturates roughly one core per video, so by default
+        # dispatch multiple videos to worker processes, leaving half the cores for decoding/encoding:
+        max_workers = self.max_workers
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) // 2)
+        max_workers = min(max_workers, len(self.input_video_paths))
+
+        # the configuration to be shipped to each worker process. This must contain only plain,
+        # picklable data: the detectors themselves get rebuilt inside each worker. worker_threads
+        # divides the cores between the workers, so that their OpenCV/MediaPipe thread pools don't
+        # each claim the whole machine and degrade one another (it is left unset for a serial run,
+        # where the single process may as well use every core):
+        worker_threads = None
+        if max_workers > 1:
+            worker_threads = max(1, (os.cpu_count() or 2) // max_workers)
+        config = {'track': self.track,
+                  'model_folder': self.model_folder,
+                  'features': self.features,
+                  'output_video_folder': self.output_video_folder,
+                  'output_data_folder': self.output_data_folder,
+                  'write_annotated_video': self.write_annotated_video,
+                  'prefetch': self.prefetch,
+                  'allow_frame_drop': self.allow_frame_drop,
+                  'frame_stride': self.frame_stride,
+                  'detect_width': self.detect_width,
+                  'detector_strides': self.detector_strides,
+                  'output_fourcc': self.output_fourcc,
+                  'use_gpu': self.use_gpu,
+                  'worker_threads': worker_threads}
 
-            files_progress.write(' ' + video)
-            files_progress.update()
-            files_progress.refresh()
+        if max_workers == 1:  # process serially in this process (keeps per-frame progress bars tidy)
+            for video in self.input_video_paths:
+                _process_one(video, config)
+                files_progress.write(' ' + video)
+                files_progress.update()
+                files_progress.refresh()
+        else:
+            with ProcessPoolExecutor(max_workers = max_workers) as executor:
+                futures = {executor.submit(_process_one, video, config): video
+                           for video in self.input_video_paths}
+                for future in as_completed(futures):
+                    files_progress.write(' ' + future.result())
+                    files_progress.update()
+                    files_progress.refresh()
 
         end = datetime.datetime.now()
         print(f'Finished processing at {str(end).split(".")[0]}.')
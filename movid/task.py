@@ -1,4 +1,8 @@
 import os
+import queue
+import operator
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -10,6 +14,73 @@ from mediapipe.tasks.python import vision
 from mediapipe import solutions
 from mediapipe.framework.formats import landmark_pb2
 
+# ffmpegcv provides FFmpeg-based (and, on NVIDIA hardware, GPU-accelerated) video decoding and
+# encoding, which is substantially faster than OpenCV's bundled backends on long clinical
+# recordings. It is an optional dependency: if not installed, we fall back to OpenCV's
+# VideoCapture/VideoWriter:
+try:
+    import ffmpegcv
+except ImportError:
+    ffmpegcv = None
+
+# sentinel pushed onto the write queue to tell the writer thread that no more frames are coming.
+# A unique object rather than None, so that it can never be mistaken for (or masked by) a frame:
+_no_more_frames = object()
+
+
+# fetches all three coordinates of a landmark in a single C-level call, rather than three separate
+# Python attribute lookups across the protobuf boundary (which add up to ~100M lookups over an
+# hour-long video with the face detector enabled):
+_get_xyz = operator.attrgetter('x', 'y', 'z')
+
+
+def _detect_frame_size(width, height, detect_width):
+    # the frame size to use for inference when downscaling, preserving the aspect ratio. The height
+    # is rounded to an even number, as some encoders require it:
+    detect_height = max(2, int(round(height * detect_width / width / 2.0)) * 2)
+    return (int(detect_width), detect_height)
+
+
+def create_detectors(detector_options):
+    # instantiate a detector (e.g. a HandLandmarker object) for each set of options. Creating a
+    # detector loads its model file from disk and initialises the inference graph, which takes from
+    # hundreds of milliseconds up to seconds, so callers processing multiple videos should create
+    # the detectors once and reuse them (see processor._process_one), rather than paying that cost
+    # per video:
+    detectors = []
+    for item in detector_options:
+
+        if item['type'] == 'hands':
+            detector = vision.HandLandmarker.create_from_options(item['options'])
+
+        if item['type'] == 'face':
+            detector = vision.FaceLandmarker.create_from_options(item['options'])
+
+        if item['type'] == 'pose':
+            detector = vision.PoseLandmarker.create_from_options(item['options'])
+            # landmark accuracy and inference latency generally go up with the model
+            # complexity. Would default to 1:
+            detector.model_complexity = 2
+
+        detectors.append({'type': item['type'],
+                          'detector': detector,
+                          'options': item['options'],
+                          'stride': item.get('stride', 1)})
+
+    return detectors
+
+
+def _landmarks_to_proto(landmarks):
+    # pack detected landmarks into the protobuf list that the mediapipe drawing utilities expect.
+    # this runs once per detection per frame (478 landmarks for a face), so keep the Python overhead
+    # down: the constructor is aliased to a local name and fed to extend() as a generator, avoiding
+    # an intermediate list of landmark objects:
+    proto = landmark_pb2.NormalizedLandmarkList()
+    normalized_landmark = landmark_pb2.NormalizedLandmark
+    proto.landmark.extend(normalized_landmark(x = landmark.x, y = landmark.y, z = landmark.z)
+                          for landmark in landmarks)
+    return proto
+
 class Task:
     # This class represents a recording of a single UPDRS task. It needs to have a path to a source video to be
     # analysed. This will then be processed using one or more MediaPipe detectors (e.g. for detecting hand, face, or
@@ -20,15 +91,58 @@ class Task:
 
     def __init__(self, parent_proc, video_path):
 
-        self.video_in = cv2.VideoCapture(video_path)
-        if not self.video_in.isOpened():
-            print(f'Error opening the video file {video_path}')
-            return
+        # prefer ffmpegcv for decoding if it is available, requesting frames directly in RGB
+        # (as MediaPipe wants) so we can skip the per-frame BGR-to-RGB conversion entirely.
+        # try the NVIDIA-accelerated reader first, then plain FFmpeg, then fall back to OpenCV:
+        self.use_ffmpegcv = False
+        reader_cls = None
+        if ffmpegcv is not None:
+            for reader_cls in (ffmpegcv.VideoCaptureNV, ffmpegcv.VideoCapture):
+                try:
+                    self.video_in = reader_cls(video_path, pix_fmt = 'rgb24')
+                    self.use_ffmpegcv = True
+                    break
+                except Exception:
+                    continue
+
+        # if configured, frames are downscaled to this width before inference. MediaPipe's landmark
+        # models resample to ~192-256 px internally anyway, so feeding full-resolution frames just
+        # moves more bytes through every conversion and copy. The landmark coordinates are
+        # normalised, so nothing downstream needs scaling back:
+        detect_width = getattr(parent_proc, 'detect_width', None)
+
+        if self.use_ffmpegcv:
+            self.fps = round(self.video_in.fps, 3)
+            self.num_frames = int(self.video_in.count)
+            self.width = int(self.video_in.width)
+            self.height = int(self.video_in.height)
+
+            # ffmpegcv can downscale on the decoder itself (essentially free with NVDEC), so reopen
+            # with a resize. Note that on this path the annotated video is also written at the
+            # reduced size:
+            if detect_width and detect_width < self.width:
+                self.width, self.height = _detect_frame_size(self.width, self.height, detect_width)
+                self.video_in.release()
+                self.video_in = reader_cls(video_path, pix_fmt = 'rgb24',
+                                           resize = (self.width, self.height))
+        else:
+            self.video_in = cv2.VideoCapture(video_path)
+            if not self.video_in.isOpened():
+                print(f'Error opening the video file {video_path}')
+                return
+
+            self.fps = round(self.video_in.get(cv2.CAP_PROP_FPS), 3)
+            self.num_frames = int(self.video_in.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.width = int(self.video_in.get(3))
+            self.height = int(self.video_in.get(4))
+
+        self._ms_per_frame = 1000.0 / self.fps if self.fps else 0.0
 
-        self.fps = round(self.video_in.get(cv2.CAP_PROP_FPS), 3)
-        self.num_frames = int(self.video_in.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.width = int(self.video_in.get(3))
-        self.height = int(self.video_in.get(4))
+        # on the OpenCV path, frames are decoded at source resolution and downscaled on the CPU just
+        # before inference, so the annotated video keeps its full resolution:
+        self._detect_size = None
+        if not self.use_ffmpegcv and detect_width and detect_width < self.width:
+            self._detect_size = _detect_frame_size(self.width, self.height, detect_width)
 
         self.video_in_folder_path, self.video_in_filename = os.path.split(video_path)
         filename_parts = self.video_in_filename.split('_')
@@ -42,246 +156,621 @@ class Task:
             self.task = 'not parsed'
 
         self.video_out = None  # not initialised until process_video() called
+        # whether to produce an annotated video at all. Drawing the landmarks (up to ~500 per frame)
+        # and re-encoding every frame can be half of the total runtime, so when only the numeric
+        # output is wanted, the whole annotation path can be skipped:
+        self.write_annotated_video = parent_proc.write_annotated_video
+        # how many decoded frames the reader thread may buffer ahead of inference. Each buffered
+        # frame is a full uncompressed image, so this bounds peak memory at roughly
+        # prefetch x width x height x 3 bytes (4K/60 fps sources would otherwise balloon RSS):
+        self.prefetch = getattr(parent_proc, 'prefetch', 8)
+        # for preview runs only: when the buffer is full, discard the oldest frame instead of
+        # stalling the decoder (the dropped frames are simply absent from the output):
+        self.allow_frame_drop = getattr(parent_proc, 'allow_frame_drop', False)
+        # analyse only every Nth frame of the video (1 = all frames). Timestamps are always in
+        # source-frame time, so the saved data stays on the true clock:
+        self.frame_stride = max(1, int(getattr(parent_proc, 'frame_stride', 1)))
         # the name of a subfolder where the annotated video will be saved (should be different to the folder containing
         # the original source videos, to avoid over-writing source data):
         self.video_out_folder_path = parent_proc.output_video_folder
         self.video_out_filename = f'{self.video_in_filename[:-4]}_{parent_proc.features}_labelled.mp4'
         self.output_data_folder = parent_proc.output_data_folder
-        self.output_data_filename = f'{self.video_in_filename[:-4]}_{parent_proc.features}_csv.gz'
+        self.output_data_filename = f'{self.video_in_filename[:-4]}_{parent_proc.features}.parquet'
 
-        # this 4-byte code controls the video codec to be used. See
+        # this 4-byte code controls the video codec used by the OpenCV fallback writer. See
         # https://gist.github.com/takuma7/44f9ecb028ff00e2132e for Mac-compatible values.
-        # avc1 compresses well but seemed to produce keyframe artefacts:
-        # fourcc = cv2.VideoWriter_fourcc('a', 'v', 'c', '1')
-        # mp4v compresses less well but gives quality comparable to original colour file:
-        self.fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
-
-        # from the parent processor, work through its list of detector options (e.g. one each for hands, face, pose) and
-        # from each instantiate eg a HandLandmarker object, which needs to be done afresh for each video:
-        self.detectors = []
+        # avc1 compresses well but seemed to produce keyframe artefacts, so mp4v (which gives
+        # quality comparable to the original colour file) remains the default. A different codec
+        # can be requested via Processor(output_fourcc = ...), e.g. 'avc1' where an FFmpeg build
+        # with a hardware H.264 encoder is available (which encodes faster and compresses better):
+        self.fourcc = cv2.VideoWriter_fourcc(*getattr(parent_proc, 'output_fourcc', 'mp4v'))
+
+        # record the landmark names for each feature type to be tracked (hands, face, pose):
+        self.landmark_names = {}  # per detector type, an array of landmark names in model order
         for item in parent_proc.detector_options:
 
             if item['type'] == 'hands':
-                detector = vision.HandLandmarker.create_from_options(item['options'])
                 self.hand_landmark_names = [mark.name for mark in solutions.hands.HandLandmark]
+                self.landmark_names['hands'] = np.asarray(self.hand_landmark_names, dtype = object)
 
             if item['type'] == 'face':
-                detector = vision.FaceLandmarker.create_from_options(item['options'])
                 # there doesn't seem to be a list of names of these features, so we just number them.
                 # TODO: Usually said to be 468 but is 478 if irises are tracked: it is dangerous to be hardcoding this.
                 # coerce to strings to avoid occasional floating point import issues later:
                 self.face_landmark_names = [str(i) for i in range(478)]
+                self.landmark_names['face'] = np.asarray(self.face_landmark_names, dtype = object)
 
             if item['type'] == 'pose':
-                detector = vision.PoseLandmarker.create_from_options(item['options'])
-                # landmark accuracy and inference latency generally go up with the model
-                # complexity. Would default to 1:
-                detector.model_complexity = 2
                 self.pose_landmark_names = [mark.name for mark in solutions.pose.PoseLandmark]
-
-            self.detectors.append({'type': item['type'],
-                                   'detector': detector,
-                                   'options': item['options']})
-
-        # initialise an empty  dataframe to hold the coordinates of the detected landmarks:
+                self.landmark_names['pose'] = np.asarray(self.pose_landmark_names, dtype = object)
+
+        # use detector instances already created by the parent processor where available (creating
+        # one loads its model from disk and initialises the graph — expensive to repeat per video),
+        # otherwise create them afresh for this video:
+        self.detectors = getattr(parent_proc, 'detectors', None)
+        if self.detectors is None:
+            self.detectors = create_detectors(parent_proc.detector_options)
+
+        # when tracking more than one feature type, the detectors for a frame run concurrently:
+        # each owns its own MediaPipe graph and releases the GIL during inference, so they overlap
+        # on separate cores (see analyse_video). A single detector just runs inline:
+        self._detector_pool = None
+        if len(self.detectors) > 1:
+            self._detector_pool = ThreadPoolExecutor(max_workers = len(self.detectors))
+
+        # per-frame dispatch table: each detector paired with its stride and its type-specialised
+        # extract and draw methods, built once so that the hot loop needn't re-index dicts or
+        # compare detector-type strings on every frame:
+        self._extractors = {'hands': self._coords_hands, 'face': self._coords_face, 'pose': self._coords_pose}
+        self._drawers = {'hands': self._draw_hands, 'face': self._draw_face, 'pose': self._draw_pose}
+        self._detector_dispatch = [(detector, detector.get('stride', 1),
+                                    self._extractors[detector['type']],
+                                    self._drawers[detector['type']])
+                                   for detector in self.detectors]
+
+        # the drawing styles never change across a video, but MediaPipe's get_default_*_style()
+        # helpers build fresh style dicts on every call, so fetch them once here rather than once
+        # per frame in the draw methods:
+        self._hand_landmarks_style = solutions.drawing_styles.get_default_hand_landmarks_style()
+        self._hand_connections_style = solutions.drawing_styles.get_default_hand_connections_style()
+        self._face_connections_spec = solutions.drawing_utils.DrawingSpec(color = (0, 204, 255), thickness = 1)
+        self._pose_landmarks_style = solutions.drawing_styles.get_default_pose_landmarks_style()
+
+        # hands always have exactly 21 landmarks and at most two are detected, so rather than
+        # building a fresh protobuf list (42 landmark objects) for the drawing utilities on every
+        # frame, allocate one list per hand once and just overwrite its coordinates in place:
+        self._hand_protos = [landmark_pb2.NormalizedLandmarkList() for _ in range(2)]
+        for proto in self._hand_protos:
+            proto.landmark.extend(landmark_pb2.NormalizedLandmark() for _ in range(21))
+
+        # MediaPipe's VIDEO running mode requires strictly increasing timestamps per detector
+        # instance. When detectors are reused across videos, this video's timestamps are offset to
+        # continue from wherever the previous video left off (the saved data keeps video-local
+        # timestamps; the offset only applies to what the detectors see):
+        self._ts_base = max((detector.get('next_ts_base', 0) for detector in self.detectors),
+                            default = 0)
+
+        # scratch buffers reused on the OpenCV path, so the per-frame downscale (if configured) and
+        # BGR-to-RGB conversion don't allocate fresh arrays on every iteration (the ffmpegcv path
+        # delivers RGB, already downscaled, and needs neither):
+        if not self.use_ffmpegcv:
+            buffer_width, buffer_height = self._detect_size or (self.width, self.height)
+            self._rgb_buffer = np.empty((buffer_height, buffer_width, 3), dtype = np.uint8)
+            if self._detect_size is not None:
+                self._small_buffer = np.empty_like(self._rgb_buffer)
+
+        # annotation scratch buffers. On the OpenCV path the decoded BGR frame itself is drawn on
+        # (detection uses the separate RGB scratch copy). On the ffmpegcv path the decoded frame is
+        # the very buffer MediaPipe detects on, so annotation goes into a ring of preallocated
+        # frames instead — a ring rather than a single buffer, because the writer thread may still
+        # be encoding earlier frames while the current one is being drawn:
+        if self.use_ffmpegcv and self.write_annotated_video:
+            self._annot_buffers = [np.empty((self.height, self.width, 3), dtype = np.uint8)
+                                   for _ in range(self.prefetch + 2)]
+
+        # coordinates are accumulated into preallocated typed column arrays, written by cursor, and
+        # only assembled into a dataframe once, at the end of the video. The row count is bounded by
+        # frames x landmarks per detector, so the buffers can be sized up front: appending is then a
+        # slice write with no per-frame allocation (they double in the rare case a video yields more
+        # frames than its metadata reported). Labels are stored as small integer codes and expanded
+        # to strings only at assembly:
+        rows_per_frame = {'hands': 21 * 2, 'face': 478, 'pose': 33}
+        analysed_frames = -(-max(self.num_frames, 1) // self.frame_stride)  # i.e. ceil()
+        capacity = 0
+        for detector in self.detectors:
+            frames = -(-analysed_frames // detector.get('stride', 1))
+            capacity += frames * rows_per_frame[detector['type']]
+        self._capacity = max(capacity, 1024)
+        self._cursor = 0
+        self._xyz = np.empty((self._capacity, 3), dtype = np.float32)
+        self._ts = np.empty(self._capacity, dtype = np.int64)
+        self._type_codes = np.empty(self._capacity, dtype = np.int8)
+        self._side_codes = np.empty(self._capacity, dtype = np.int8)
+        self._landmark_codes = np.empty(self._capacity, dtype = np.int16)
+
+        # lookups between label strings and the integer codes stored in the buffers:
+        self._type_labels = [detector['type'] for detector in self.detectors]
+        self._type_lookup = {label: code for code, label in enumerate(self._type_labels)}
+        self._side_labels = ['']
+        self._side_lookup = {'': 0}
+        # landmarks within one detection arrive in model order, so their codes are just 0..n-1:
+        self._landmark_arange = {label: np.arange(len(names), dtype = np.int16)
+                                 for label, names in self.landmark_names.items()}
+
+        # the timestamp of every frame read from the video, whether or not each detector ran on it
+        # (detectors with a stride > 1 skip frames; their data is interpolated back onto this grid):
+        self._frame_timestamps = []
+
+        # the dataframe holding the coordinates of the detected landmarks (built after the video loop):
         self.output_data = pd.DataFrame()
 
-    def analyse_video(self):
-
-        self.video_out = (
-            cv2.VideoWriter(filename = f'{self.video_out_folder_path}/{self.video_out_filename}', fourcc = self.fourcc,
-                            fps = self.fps, frameSize = (self.width, self.height), isColor = True))
-
-        video_progress = iter(tqdm(iterable = range(self.num_frames),
-                                   desc = ' Feature tracking: ',
-                                   unit = ' frames',
-                                   colour = 'green',
-                                   position = 0,
-                                   leave = True))
-
-        thumbnail_saved = False
+    def _read_frames(self, read_queue, stop_reading):
+        # runs on a background thread: decode frames as fast as the main thread can consume them, so that
+        # decoding of the next frame overlaps with the (compute-bound) MediaPipe inference on the current one.
+        # note that only reading happens here: the stateful detectors must stay on the main thread, as
+        # MediaPipe's VIDEO running mode is not thread-safe.
+        # for constant-frame-rate sources the timestamp is derived from the frame index, rather than
+        # queried from the decoder on every frame — an FFI call which, on .MOV files, can also stall
+        # the demuxer. The first few frames are checked against the decoder clock: if they deviate,
+        # the source has a variable frame rate and we fall back to querying per frame. (The ffmpegcv
+        # readers don't expose a clock at all, so there the derived time is always used.)
+        use_computed = self.fps > 0
+        stride = self.frame_stride
         frame_n = -1
 
-        while self.video_in.isOpened():
-
-            # capture frame-by-frame
-            success, bgr_image = self.video_in.read()
-            if not success:
-                break
+        def enqueue(item):
+            # a plain put() would block forever on the bounded queue if the main loop has bailed
+            # out with an error; poll the stop event instead, so this thread can always be wound up:
+            while not stop_reading.is_set():
+                try:
+                    read_queue.put(item, timeout = 0.25)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        while not stop_reading.is_set():
+            if stride > 1 and not self.use_ffmpegcv:
+                # grab() advances the demuxer without decoding, so only every stride-th frame pays
+                # for a full decode via retrieve():
+                if not self.video_in.grab():
+                    break
+                frame_n += 1
+                if frame_n % stride:
+                    continue
+                success, image = self.video_in.retrieve()
+                if not success:
+                    break
             else:
-                next(video_progress)
+                success, image = self.video_in.read()
+                if not success:
+                    break
                 frame_n += 1
+                if frame_n % stride:  # the ffmpegcv readers can't skip decoding; discard instead
+                    continue
+            if use_computed:
+                time_stamp = int(round(frame_n * self._ms_per_frame))
+                if not self.use_ffmpegcv and frame_n < 10:
+                    reported = self.video_in.get(cv2.CAP_PROP_POS_MSEC)
+                    # depending on the backend, POS_MSEC may report the just-decoded frame or the
+                    # next one; accept either when checking that the frame rate really is constant:
+                    if min(abs(reported - frame_n * self._ms_per_frame),
+                           abs(reported - (frame_n + 1) * self._ms_per_frame)) > 1.0:
+                        use_computed = False
+                        time_stamp = int(reported)
+            else:
                 time_stamp = int(self.video_in.get(cv2.CAP_PROP_POS_MSEC))  # time in ms
-                rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
+            if self.allow_frame_drop and read_queue.full():
+                # keep decoding at full speed by sacrificing the oldest buffered frame:
+                try:
+                    read_queue.get_nowait()
+                except queue.Empty:
+                    pass
+            if not enqueue((frame_n, image, time_stamp)):
+                return
+        enqueue(None)  # sentinel: tells the main loop that the video is exhausted
+
+    def _write_frames(self, write_queue):
+        # runs on a background thread: encode annotated frames, so that encoding of the previous frame
+        # overlaps with inference on the current one.
+        while True:
+            annotated_image = write_queue.get()
+            if annotated_image is _no_more_frames:
+                break
+            self.video_out.write(annotated_image)
+
+    def analyse_video(self):
+
+        if self.write_annotated_video:
+            video_out_path = f'{self.video_out_folder_path}/{self.video_out_filename}'
+            # when analysing only every Nth frame, write at a proportionally reduced frame rate so
+            # the annotated video still plays back in real time:
+            out_fps = self.fps / self.frame_stride
+            if self.use_ffmpegcv:
+                # match the reader: frames flow through the pipeline in RGB, so tell the writer that.
+                # try the NVIDIA-accelerated encoder first, then plain FFmpeg:
+                try:
+                    self.video_out = ffmpegcv.VideoWriterNV(video_out_path, 'h264', out_fps, pix_fmt = 'rgb24')
+                except Exception:
+                    self.video_out = ffmpegcv.VideoWriter(video_out_path, 'h264', out_fps, pix_fmt = 'rgb24')
+            else:
+                self.video_out = (
+                    cv2.VideoWriter(filename = video_out_path, fourcc = self.fourcc,
+                                    fps = out_fps, frameSize = (self.width, self.height), isColor = True))
+
+        # the progress bar sits inside the per-frame loop, so keep its bookkeeping cheap: update the
+        # display at most every ~0.5% of the video (and no more than twice a second), rather than
+        # taking tqdm's lock and re-formatting the bar on every single frame:
+        analysed_frames = -(-self.num_frames // self.frame_stride)  # i.e. ceil()
+        video_progress = tqdm(total = analysed_frames,
+                              desc = ' Feature tracking: ',
+                              unit = ' frames',
+                              colour = 'green',
+                              position = 0,
+                              leave = True,
+                              miniters = max(1, analysed_frames // 200),
+                              mininterval = 0.5)
+
+        thumbnail_saved = False
+        last_time_stamp = -1
+        analysed_n = 0  # count of frames consumed from the reader (advances by 1 regardless of stride)
+
+        # decode and encode run on their own threads, connected to the main (inference) thread by bounded
+        # queues, so the three stages of the pipeline overlap rather than running strictly in sequence.
+        # the maxsize bounds how many decoded frames can be buffered ahead, keeping memory use in check:
+        stop_reading = threading.Event()  # lets the teardown path unblock and stop the reader
+        read_queue = queue.Queue(maxsize = self.prefetch)
+        reader = threading.Thread(target = self._read_frames, args = (read_queue, stop_reading),
+                                  daemon = True)
+        reader.start()
+
+        writer = None
+        if self.write_annotated_video:
+            write_queue = queue.Queue(maxsize = self.prefetch)
+            writer = threading.Thread(target = self._write_frames, args = (write_queue,), daemon = True)
+            writer.start()
+
+        try:
+            while True:
+
+                item = read_queue.get()
+                if item is None:  # the reader thread has run out of frames
+                    break
+
+                frame_n, frame, time_stamp = item
+                analysed_n += 1
+                last_time_stamp = time_stamp
+                self._frame_timestamps.append(time_stamp)
+                video_progress.update()
+                if self.use_ffmpegcv:
+                    rgb_image = frame  # the decoder already delivered RGB (downscaled if configured)
+                else:
+                    detect_frame = frame
+                    if self._detect_size is not None:
+                        detect_frame = cv2.resize(frame, self._detect_size, dst = self._small_buffer,
+                                                  interpolation = cv2.INTER_AREA)
+                    rgb_image = cv2.cvtColor(detect_frame, cv2.COLOR_BGR2RGB, dst = self._rgb_buffer)
                 mp_image = mp.Image(image_format = mp.ImageFormat.SRGB, data = rgb_image)
 
+                # every analysed frame goes into the annotated video, drawn on or not (with per-detector
+                # strides, a frame may have no active detector at all - it must still be written, or
+                # playback would run fast and out of sync with out_fps). The annotation buffer must not
+                # alias the image MediaPipe is detecting on: on the OpenCV path the decoded BGR frame is
+                # scribbled on directly (detection uses the RGB scratch copy), while on the ffmpegcv
+                # path the frame itself feeds MediaPipe, so it is copied into the next buffer of the
+                # preallocated ring:
                 annotated_image = None
-
-                for detector in self.detectors:
-                    #  detect landmarks from the input image:
-                    detection_result = (
-                        detector['detector'].detect_for_video(image = mp_image,
-                                                              timestamp_ms = time_stamp,
-                                                              image_processing_options = detector['options']))
-
-                    # extract the coordinates:
-                    coords = self.get_coords(detection_result, detector['type'])
-                    coords['time_stamp'] = time_stamp
-                    self.output_data = pd.concat([self.output_data, coords], ignore_index = True)
-
-                    # draw the coordinates:
-                    if annotated_image is None:
-                        annotated_image = bgr_image
-                    annotated_image = self.draw_landmarks_on_image(rgb_image = annotated_image,
-                                                                   detection_result = detection_result,
-                                                                   detector_type = detector['type'])
-                self.video_out.write(annotated_image)
-
-                # save a (hopefully) representative thumbnail at ~ 50% of the way through:
-                if not thumbnail_saved:
-                    if frame_n >= self.num_frames * 0.50:
-                        cv2.imwrite(filename = f'{self.video_out_folder_path}/{self.video_out_filename[:-4]}.jpg',
-                                    img = annotated_image,
-                                    params = [cv2.IMWRITE_JPEG_QUALITY, 85])
-                        thumbnail_saved = True
-
-        # tidy up:
-        self.video_in.release()
-        self.video_out.release()
-
-        self.output_data['task'] = self.task
-        self.output_data['date'] = self.date
-        self.output_data['subject'] = self.subject
-        self.output_data['video'] = self.video_in_filename
-        self.output_data.to_csv(f'{self.output_data_folder}/{self.output_data_filename}',
-                                index = False)
-
-    def get_coords(self, detection_result, detector_type):
+                if self.write_annotated_video:
+                    if self.use_ffmpegcv:
+                        # the ring is cycled by the count of consumed frames, not by frame_n: with a
+                        # frame stride, frame_n advances in stride-sized steps and would revisit only a
+                        # subset of the buffers, overwriting frames still queued for encoding:
+                        annotated_image = self._annot_buffers[analysed_n % len(self._annot_buffers)]
+                        np.copyto(annotated_image, frame)
+                    else:
+                        annotated_image = frame
+
+                # which detectors run on this frame: those configured with a stride only run on every
+                # stride-th frame (e.g. the face detector can safely sample at half the frame rate;
+                # facial movement is slow):
+                active_detectors = [entry for entry in self._detector_dispatch
+                                    if entry[1] == 1 or frame_n % entry[1] == 0]
+
+                # detect landmarks from the input image. Each detector owns its own MediaPipe graph and
+                # releases the GIL during inference, so when more than one feature type is tracked, the
+                # detectors run concurrently on the thread pool and the frame costs roughly the slowest
+                # detector rather than the sum of all of them:
+                if self._detector_pool is not None and len(active_detectors) > 1:
+                    futures = [self._detector_pool.submit(self._detect_one, entry[0], mp_image, time_stamp)
+                               for entry in active_detectors]
+                    detection_results = [future.result() for future in futures]
+                else:
+                    detection_results = [self._detect_one(entry[0], mp_image, time_stamp)
+                                         for entry in active_detectors]
+
+                for (detector, stride, extract, draw), detection_result in zip(active_detectors,
+                                                                               detection_results):
+                    # extract the coordinates (buffered; the dataframe is built once after the loop):
+                    extract(detection_result, time_stamp)
+
+                    # draw the coordinates, in place: every detector for this frame draws into the same
+                    # buffer:
+                    if annotated_image is not None:
+                        draw(annotated_image, detection_result)
+
+                if self.write_annotated_video:
+                    write_queue.put(annotated_image)
+
+                    # save a (hopefully) representative thumbnail at ~ 50% of the way through:
+                    if not thumbnail_saved:
+                        if frame_n >= self.num_frames * 0.50:
+                            thumbnail = annotated_image
+                            if self.use_ffmpegcv:  # cv2.imwrite expects BGR; one-off conversion is fine here
+                                thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2BGR)
+                            cv2.imwrite(filename = f'{self.video_out_folder_path}/{self.video_out_filename[:-4]}.jpg',
+                                        img = thumbnail,
+                                        params = [cv2.IMWRITE_JPEG_QUALITY, 85])
+                            thumbnail_saved = True
+        finally:
+            # tidy up: runs on the error path too, so that a failed video (a MediaPipe timestamp
+            # error, a writer failure) doesn't leave the reader thread blocked forever on the full
+            # queue, holding the input file open - particularly inside a reused worker process:
+            video_progress.close()
+            if self._detector_pool is not None:
+                self._detector_pool.shutdown()
+            stop_reading.set()
+            reader.join()
+            if writer is not None:
+                # the guarded put can't deadlock if the writer thread itself has died with the
+                # queue full; wait for any remaining annotated frames to be encoded, then close:
+                while writer.is_alive():
+                    try:
+                        write_queue.put(_no_more_frames, timeout = 0.25)
+                        break
+                    except queue.Full:
+                        pass
+                writer.join()
+                self.video_out.release()
+            self.video_in.release()
+
+        # record where this video's (offset) timestamps finished, so that if the detectors are
+        # reused for a subsequent video, its timestamps can carry on strictly increasing:
+        next_base = self._ts_base + last_time_stamp + max(1, int(round(self._ms_per_frame)))
+        for detector in self.detectors:
+            detector['next_ts_base'] = next_base
+
+        self.output_data = self._assemble_output_data()
+
+        # any detector that ran with a stride > 1 only produced rows every stride-th frame: fill in
+        # the skipped frames by linear interpolation, so every detector reports on the same
+        # per-frame timestamp grid:
+        strided_types = {detector['type'] for detector in self.detectors if detector.get('stride', 1) > 1}
+        if strided_types and not self.output_data.empty:
+            strided = self.output_data['detector_type'].isin(strided_types)
+            if strided.any():
+                dense = self._interpolate_strided(self.output_data[strided])
+                self.output_data = pd.concat([self.output_data[~strided], dense], ignore_index = True)
+
+        # attach the per-video metadata columns in a single assign (one block-manager pass, rather
+        # than four separate inserts):
+        self.output_data = self.output_data.assign(task = self.task,
+                                                   date = self.date,
+                                                   subject = self.subject,
+                                                   video = self.video_in_filename)
+
+        # save as Parquet rather than gzipped CSV: columnar, typed, several times smaller and much
+        # faster to write and to read back in for analysis. The label columns are highly repetitive,
+        # so store them as categories:
+        for column in ['detector_type', 'landmark', 'side', 'task', 'date', 'subject', 'video']:
+            self.output_data[column] = self.output_data[column].astype('category')
+        self.output_data.to_parquet(f'{self.output_data_folder}/{self.output_data_filename}',
+                                    engine = 'pyarrow', compression = 'zstd', index = False)
+
+    def _detect_one(self, detector, mp_image, time_stamp):
+        # run one detector on one frame (possibly on a pool thread; each detector's graph is
+        # independent, and only this thread touches this detector):
+        return detector['detector'].detect_for_video(image = mp_image,
+                                                     timestamp_ms = self._ts_base + time_stamp,
+                                                     image_processing_options = detector['options'])
+
+    def get_coords(self, detection_result, detector_type, time_stamp):
         # this function is passed:
         #  detection_result: the output from the function
         #                    mediapipe.tasks.python.vision.HandLandmarker.detect_for_video()
         #                    previously applied to that frame. This object contains the
         #                    image (and world) coordinates of the various landmarks.
-        # this functions returns a dataframe of coordinates for each landmark.
-
-        output = pd.DataFrame()
-
-        if detector_type == 'hands':
-            features = detection_result.hand_world_landmarks
-        elif detector_type == 'face':
-            features = detection_result.face_landmarks
-        elif detector_type == 'pose':
-            features = detection_result.pose_world_landmarks
-
-        for i, landmarks in enumerate(features):
-
-            coords = [{'x': landmark.x, 'y': landmark.y, 'z': landmark.z}
-                      for landmark in landmarks]
-
-            temp_df = pd.DataFrame.from_records(coords)
-            temp_df['detector_type'] = detector_type
-            if detector_type == 'hands':
-                temp_df['landmark'] = self.hand_landmark_names  # assumed to be in same order from 0 to 20
-                temp_df['side'] = detection_result.handedness[i][0].display_name
-            elif detector_type == 'face':
-                temp_df['landmark'] = self.face_landmark_names  # just numbers from 0 to 477
-                temp_df['side'] = ''
-            elif detector_type == 'pose':
-                temp_df['landmark'] = self.pose_landmark_names  # assumed to be in same order from 0 to 32
-                temp_df['side'] = ''
-
-            output = pd.concat([output, temp_df], ignore_index = True)
-
-        return output
-
-    def draw_landmarks_on_image(self, rgb_image, detection_result, detector_type):
+        # the coordinates of each detected hand/face/pose are written straight into the preallocated
+        # column buffers; see _assemble_output_data() for where they become a dataframe.
+        # this is just a dispatcher: the hot loop calls the type-specialised extractors directly via
+        # the per-detector dispatch table, skipping both this call and the string comparison.
+        self._extractors[detector_type](detection_result, time_stamp)
+
+    def _coords_hands(self, detection_result, time_stamp):
+        for i, landmarks in enumerate(detection_result.hand_world_landmarks):
+            self._record('hands', landmarks, detection_result.handedness[i][0].display_name, time_stamp)
+
+    def _coords_face(self, detection_result, time_stamp):
+        for landmarks in detection_result.face_landmarks:
+            self._record('face', landmarks, '', time_stamp)
+
+    def _coords_pose(self, detection_result, time_stamp):
+        for landmarks in detection_result.pose_world_landmarks:
+            self._record('pose', landmarks, '', time_stamp)
+
+    def _record(self, detector_type, landmarks, side, time_stamp):
+        # write one detection (one hand/face/pose) into the preallocated column buffers:
+        n = len(landmarks)
+        self._ensure_capacity(n)
+        cursor = self._cursor
+        self._xyz[cursor:cursor + n] = np.array(list(map(_get_xyz, landmarks)), dtype = np.float32)
+        self._ts[cursor:cursor + n] = time_stamp
+        self._type_codes[cursor:cursor + n] = self._type_lookup[detector_type]
+        self._side_codes[cursor:cursor + n] = self._side_code(side)
+        self._landmark_codes[cursor:cursor + n] = self._landmark_arange[detector_type][:n]
+        self._cursor = cursor + n
+
+    def _side_code(self, side):
+        # the integer code for a side label ('', 'Left', 'Right'), registering it if new:
+        code = self._side_lookup.get(side)
+        if code is None:
+            code = len(self._side_labels)
+            self._side_labels.append(side)
+            self._side_lookup[side] = code
+        return code
+
+    def _ensure_capacity(self, extra):
+        # grow the column buffers (by doubling) in the rare case that a video yields more rows than
+        # its reported frame count implied:
+        needed = self._cursor + extra
+        if needed <= self._capacity:
+            return
+        while self._capacity < needed:
+            self._capacity *= 2
+        for name in ('_xyz', '_ts', '_type_codes', '_side_codes', '_landmark_codes'):
+            old = getattr(self, name)
+            grown = np.empty((self._capacity,) + old.shape[1:], dtype = old.dtype)
+            grown[:self._cursor] = old[:self._cursor]
+            setattr(self, name, grown)
+
+    def _interpolate_strided(self, data):
+        # reindex each landmark's time series onto the full per-frame timestamp grid and linearly
+        # interpolate the coordinates of the frames its detector skipped. This runs once per video,
+        # and only over the detector types that were configured with a stride > 1:
+        all_timestamps = pd.Index(self._frame_timestamps, name = 'time_stamp')
+        pieces = []
+        for (detector_type, landmark, side), group in data.groupby(['detector_type', 'landmark', 'side'],
+                                                                   sort = False):
+            group = group.set_index('time_stamp')
+            # MediaPipe can label both detected hands with the same handedness for a few frames, so
+            # a (detector_type, landmark, side) group may hold two rows for one timestamp - keep
+            # the first, as reindexing onto the frame grid needs unique labels:
+            if not group.index.is_unique:
+                group = group[~group.index.duplicated()]
+            group = group.reindex(all_timestamps)
+            # interpolate only between detections ('inside'): extrapolating across leading or
+            # trailing dropout would fabricate frozen coordinates for frames where the detector
+            # ran and genuinely found nothing:
+            group[['x', 'y', 'z']] = group[['x', 'y', 'z']].interpolate(method = 'index',
+                                                                        limit_area = 'inside')
+            # frames outside the detected span stay NaN after interpolation; drop them, matching
+            # the unstrided detectors, which simply produce no rows for detection-less frames:
+            group = group.dropna(subset = ['x', 'y', 'z'])
+            group['detector_type'] = detector_type
+            group['landmark'] = landmark
+            group['side'] = side
+            pieces.append(group.reset_index())
+        return pd.concat(pieces, ignore_index = True)
+
+    def _assemble_output_data(self):
+        # turn the filled portion of the preallocated column buffers into a single dataframe, in one
+        # pass. The integer label codes are expanded back into their strings here: detector type and
+        # side by simple fancy indexing, and landmark names per detector type (they are assumed to
+        # be in model order, e.g. 0 to 20 for hands).
+
+        n = self._cursor
+        if n == 0:
+            return pd.DataFrame(columns = ['x', 'y', 'z', 'detector_type', 'landmark', 'side', 'time_stamp'])
+
+        xyz = self._xyz[:n]
+        type_codes = self._type_codes[:n]
+        landmark_codes = self._landmark_codes[:n]
+
+        landmark = np.empty(n, dtype = object)
+        for code, type_label in enumerate(self._type_labels):
+            of_type = type_codes == code
+            if of_type.any():
+                landmark[of_type] = self.landmark_names[type_label][landmark_codes[of_type]]
+
+        return pd.DataFrame(
+            {'x': xyz[:, 0],
+             'y': xyz[:, 1],
+             'z': xyz[:, 2],
+             'detector_type': np.asarray(self._type_labels, dtype = object)[type_codes],
+             'landmark': landmark,
+             'side': np.asarray(self._side_labels, dtype = object)[self._side_codes[:n]],
+             'time_stamp': self._ts[:n]})
+
+    def draw_landmarks_on_image(self, image, detection_result, detector_type):
 
         # this function is passed:
-        #  rgb_image: a single frame from a video, and
+        #  image: a single frame from a video, which is annotated IN PLACE (all the OpenCV drawing
+        #         calls work in place, so no full-frame copy is ever made here), and
         #  detection_result: the output from the function
         #                    mediapipe.tasks.python.vision.HandLandmarker.detect_for_video()
         #                    previously applied to that frame. This object contains the
         #                    image (and world) coordinates of the various landmarks.
+        # this is just a dispatcher: the hot loop calls the type-specialised draw methods directly
+        # via the per-detector dispatch table, skipping both this call and the string comparison.
+        self._drawers[detector_type](image, detection_result)
+
+    def _draw_hands(self, image, detection_result):
 
         margin = 10  # pixels
         font_size = 1
         font_thickness = 1
         handedness_text_colour = (88, 205, 54)  # vibrant green
 
-        annotated_image = np.copy(rgb_image)
-
-        # TODO - generalise to other detectors:
-        if detector_type == 'hands':
-            hand_landmarks_list = detection_result.hand_landmarks
-            handedness_list = detection_result.handedness
-
-            # Loop through the detected hands to visualize.
-            for (hand_landmarks, handedness) in zip(hand_landmarks_list, handedness_list):
-                # Draw the hand landmarks.
-                hand_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-
-                hand_landmarks_proto.landmark.extend([landmark_pb2.NormalizedLandmark(x = landmark.x,
-                                                                                      y = landmark.y,
-                                                                                      z = landmark.z)
-                                                      for landmark in hand_landmarks])
-
-                solutions.drawing_utils.draw_landmarks(
-                    annotated_image,
-                    hand_landmarks_proto,
-                    solutions.hands.HAND_CONNECTIONS,
-                    solutions.drawing_styles.get_default_hand_landmarks_style(),
-                    solutions.drawing_styles.get_default_hand_connections_style())
-
-                # Get the top left corner of the detected hand's bounding box.
-                height, width, _ = annotated_image.shape
-                x_coordinates = [landmark.x for landmark in hand_landmarks]
-                y_coordinates = [landmark.y for landmark in hand_landmarks]
-                text_x = int(min(x_coordinates) * width)
-                text_y = int(min(y_coordinates) * height) - margin
-
-                # draw handedness (left or right hand) on the image.
-                # this will currently be incorrect, as mediapipe assumes the camera is front-facing:
-                cv2.putText(annotated_image, f'{handedness[0].category_name}',
-                            (text_x, text_y), cv2.FONT_HERSHEY_DUPLEX,
-                            font_size, handedness_text_colour, font_thickness, cv2.LINE_AA)
-
-        if detector_type == 'face':
-            # see https://github.com/googlesamples/mediapipe/blob/main/examples/face_landmarker/python/%5BMediaPipe_Python_Tasks%5D_Face_Landmarker.ipynb
-
-            for face_landmarks in detection_result.face_landmarks:
-                # Draw the face landmarks.
-                face_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-
-                face_landmarks_proto.landmark.extend([landmark_pb2.NormalizedLandmark(x = landmark.x,
-                                                                                      y = landmark.y,
-                                                                                      z = landmark.z)
-                                                      for landmark in face_landmarks])
-
-                solutions.drawing_utils.draw_landmarks(
-                    image = annotated_image,
-                    landmark_list = face_landmarks_proto,
-                    connections = solutions.face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec = None,
-                    connection_drawing_spec = solutions.drawing_utils.DrawingSpec(color = (0, 204, 255), thickness = 1))
-                    #connection_drawing_spec = solutions.drawing_styles.get_default_face_mesh_tesselation_style())
-
-        if detector_type == 'pose':
-
-            for pose_landmarks in detection_result.pose_landmarks:
-                # Draw the hand landmarks.
-                pose_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-
-                pose_landmarks_proto.landmark.extend([landmark_pb2.NormalizedLandmark(x = landmark.x,
-                                                                                      y = landmark.y,
-                                                                                      z = landmark.z)
-                                                      for landmark in pose_landmarks])
-
-                solutions.drawing_utils.draw_landmarks(
-                    annotated_image,
-                    pose_landmarks_proto,
-                    solutions.pose.POSE_CONNECTIONS,
-                    solutions.drawing_styles.get_default_pose_landmarks_style(),
-                    #solutions.drawing_styles.get_default_pose_connections_style()
-                )
-
-        return annotated_image
+        hand_landmarks_list = detection_result.hand_landmarks
+        handedness_list = detection_result.handedness
+
+        # Loop through the detected hands to visualize.
+        for (hand_n, (hand_landmarks, handedness)) in enumerate(zip(hand_landmarks_list, handedness_list)):
+            # Draw the hand landmarks, overwriting the coordinates of this hand's preallocated
+            # protobuf list rather than constructing a fresh one:
+            hand_landmarks_proto = self._hand_protos[hand_n]
+            for (proto_landmark, landmark) in zip(hand_landmarks_proto.landmark, hand_landmarks):
+                proto_landmark.x = landmark.x
+                proto_landmark.y = landmark.y
+                proto_landmark.z = landmark.z
+
+            solutions.drawing_utils.draw_landmarks(
+                image,
+                hand_landmarks_proto,
+                solutions.hands.HAND_CONNECTIONS,
+                self._hand_landmarks_style,
+                self._hand_connections_style)
+
+            # Get the top left corner of the detected hand's bounding box. A single pass packs
+            # the coordinates into one small array and numpy does the reductions, rather than
+            # building two Python lists and min()-ing each:
+            height, width, _ = image.shape
+            xy = np.fromiter((coord for landmark in hand_landmarks
+                              for coord in (landmark.x, landmark.y)),
+                             dtype = np.float32, count = len(hand_landmarks) * 2).reshape(-1, 2)
+            text_x = int(xy[:, 0].min() * width)
+            text_y = int(xy[:, 1].min() * height) - margin
+
+            # draw handedness (left or right hand) on the image.
+            # this will currently be incorrect, as mediapipe assumes the camera is front-facing:
+            cv2.putText(image, f'{handedness[0].category_name}',
+                        (text_x, text_y), cv2.FONT_HERSHEY_DUPLEX,
+                        font_size, handedness_text_colour, font_thickness, cv2.LINE_AA)
+
+    def _draw_face(self, image, detection_result):
+        # see https://github.com/googlesamples/mediapipe/blob/main/examples/face_landmarker/python/%5BMediaPipe_Python_Tasks%5D_Face_Landmarker.ipynb
+
+        for face_landmarks in detection_result.face_landmarks:
+            # Draw the face landmarks.
+            face_landmarks_proto = _landmarks_to_proto(face_landmarks)
+
+            solutions.drawing_utils.draw_landmarks(
+                image = image,
+                landmark_list = face_landmarks_proto,
+                connections = solutions.face_mesh.FACEMESH_TESSELATION,
+                landmark_drawing_spec = None,
+                connection_drawing_spec = self._face_connections_spec)
+                #connection_drawing_spec = solutions.drawing_styles.get_default_face_mesh_tesselation_style())
+
+    def _draw_pose(self, image, detection_result):
+
+        for pose_landmarks in detection_result.pose_landmarks:
+            # Draw the pose landmarks.
+            pose_landmarks_proto = _landmarks_to_proto(pose_landmarks)
+
+            solutions.drawing_utils.draw_landmarks(
+                image,
+                pose_landmarks_proto,
+                solutions.pose.POSE_CONNECTIONS,
+                self._pose_landmarks_style,
+                #solutions.drawing_styles.get_default_pose_connections_style()
+            )